@@ -3,14 +3,80 @@ Weather MCP Server for VSCode
 Exposes weather data from Open-Meteo API as MCP tools
 """
 
-import requests
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
 from typing import Optional, TypedDict, List
+
+import httpx
+from cachetools import TTLCache
 from pydantic import BaseModel, Field
+from geopy.extra.rate_limiter import RateLimiter
 from geopy.geocoders import Nominatim
 
+# Prefer orjson for parsing API responses, fall back to the standard library.
+# json_loads is the single JSON entry point and is always handed the raw
+# response bytes, avoiding a separate text decode.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Optional persistent cache for geocoding results
+try:
+    from diskcache import Cache
+except ImportError:
+    Cache = None
+
 # Import MCP SDK
 from mcp.server.fastmcp import FastMCP
 
+# Log through the logging module; FastMCP sends log records to stderr,
+# keeping stdout clean for the stdio JSON-RPC transport
+logger = logging.getLogger(__name__)
+
+# Shared HTTP client so forecast requests reuse pooled keep-alive connections
+_client = httpx.AsyncClient(
+    base_url="https://api.open-meteo.com",
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        retries=3,  # Retries failed connection attempts
+    ),
+    timeout=httpx.Timeout(10.0, connect=3.05),
+)
+
+
+# Forecasts and in-flight fetches, keyed by _forecast_key(). Each cache entry
+# holds the raw data and its processed responses keyed by location name, so
+# both expire together.
+_FORECAST_CACHE = TTLCache(maxsize=1024, ttl=300)
+_inflight = {}
+
+# Shared geocoder, rate limited to one request per second per Nominatim's
+# usage policy, and the on-disk geocoding cache
+_geolocator = Nominatim(user_agent="weather_mcp_server", timeout=15)
+_geocode = RateLimiter(
+    _geolocator.geocode,
+    min_delay_seconds=1,
+    max_retries=2,
+    error_wait_seconds=2.0,
+    swallow_exceptions=False,  # Let failures propagate so they are not cached
+)
+# Per-user location; diskcache stores pickles, so a shared directory is unsafe
+_GEO_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "weather_mcp", "geocode")
+_geo_disk_cache = None
+if Cache is not None:
+    try:
+        _geo_disk_cache = Cache(_GEO_CACHE_DIR)
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Geocoding disk cache disabled, cannot open %s: %s", _GEO_CACHE_DIR, e)
+
 # Create MCP server
 mcp = FastMCP("weather")
 
@@ -40,10 +106,56 @@ class DailyForecast(BaseModel):
 class WeatherResponse(BaseModel):
     """Complete weather response"""
     location: str = Field(description="Location name")
-    coordinates: tuple = Field(description="Latitude and longitude")
+    latitude: float = Field(description="Location latitude")
+    longitude: float = Field(description="Location longitude")
     current: CurrentWeather = Field(description="Current weather conditions")
     forecast: List[DailyForecast] = Field(description="Daily weather forecast")
 
+    @property
+    def coordinates(self) -> tuple:
+        """Latitude and longitude"""
+        return (self.latitude, self.longitude)
+
+
+# Internal weather data, converted to the output models at the tool boundary
+
+
+@dataclass(slots=True)
+class _CurrentWeather:
+    """Current weather conditions"""
+    temperature: float
+    feels_like: float
+    humidity: float
+    wind_speed: float
+    precipitation: float
+    conditions: str
+    units: dict
+
+
+@dataclass(slots=True)
+class _DailyForecast:
+    """Daily weather forecast"""
+    date: str
+    min_temp: float
+    max_temp: float
+    precipitation: float
+    conditions: str
+
+
+@dataclass(slots=True)
+class _WeatherResponse:
+    """Complete weather response"""
+    location: str
+    latitude: float
+    longitude: float
+    current: _CurrentWeather
+    forecast: List[_DailyForecast]
+
+
+def _fields(obj) -> dict:
+    """Shallow field mapping of a slotted dataclass instance"""
+    return {name: getattr(obj, name) for name in obj.__slots__}
+
 
 class LocationCoordinates(TypedDict):
     """Location coordinates result"""
@@ -52,10 +164,52 @@ class LocationCoordinates(TypedDict):
     location_name: str
 
 
+class _LocationNotFound(Exception):
+    """Raised when Nominatim has no match, so the miss is not memoized"""
+
+
+@functools.lru_cache(maxsize=4096)
+def _geocode_cached(city: str, state: Optional[str], country: str) -> LocationCoordinates:
+    """Geocode a location, checking the on-disk cache before querying Nominatim"""
+    key = (city, state, country)
+    if _geo_disk_cache is not None:
+        cached = _geo_disk_cache.get(key)
+        if cached is not None:
+            return LocationCoordinates(**cached)
+
+    # Build query string
+    query = city
+    if state:
+        query += f", {state}"
+    if country:
+        query += f", {country}"
+
+    logger.debug("Geocoding query: %s", query)
+
+    location = _geocode(query)
+
+    if not location:
+        raise _LocationNotFound(query)
+
+    logger.debug("Found location: %s, %s", location.latitude, location.longitude)
+    logger.debug("Address: %s", location.address)
+    result = LocationCoordinates(
+        latitude=location.latitude,
+        longitude=location.longitude,
+        location_name=location.address  # Use the full address from geocoder
+    )
+    if _geo_disk_cache is not None:
+        _geo_disk_cache.set(key, result)
+    return result
+
+
 def geocode_location(city: str, state: Optional[str] = None, country: str = "USA") -> Optional[LocationCoordinates]:
     """
     Convert city and state to latitude and longitude coordinates
 
+    Found locations are cached in memory and, when diskcache is available,
+    on disk. Misses and errors are not cached, so they are retried next call.
+
     Args:
         city: City name
         state: State name or code (optional)
@@ -64,113 +218,150 @@ def geocode_location(city: str, state: Optional[str] = None, country: str = "USA
     Returns:
         Location coordinates or None if not found
     """
+    logger.debug("Function called with: city=%s, state=%s, country=%s", city, state, country)
     try:
-        # Initialize geolocator with a user agent
-        geolocator = Nominatim(user_agent="weather_mcp_server")
-
-        # Build query string
-        query = city
-        if state:
-            query += f", {state}"
-        if country:
-            query += f", {country}"
-
-        print(f"[DEBUG] Geocoding query: {query}")  # Enhanced debug info
-        print(f"[DEBUG] Function called with: city={city}, state={state}, country={country}")
-        
-        # Get location with increased timeout
-        location = geolocator.geocode(query, timeout=15)
-
-        if location:
-            print(f"[DEBUG] Found location: {location.latitude}, {location.longitude}")  # Enhanced debug info
-            print(f"[DEBUG] Address: {location.address}")
-            return LocationCoordinates(
-                latitude=location.latitude,
-                longitude=location.longitude,
-                location_name=location.address  # Use the full address from geocoder
-            )
-        else:
-            print(f"[DEBUG] No location found for query: {query}")  # Enhanced debug info
-            return None
+        # Misses and errors propagate out of the cached call, so they are never memoized
+        result = _geocode_cached(city, state, country)
+    except _LocationNotFound as e:
+        logger.debug("No location found for query: %s", e)
+        return None
     except Exception as e:
-        print(f"Error during geocoding: {e}")
+        logger.error("Error during geocoding: %s", e)
         return None
 
+    # Hand out a copy so callers cannot mutate the cached entry
+    return LocationCoordinates(**result)
 
-def get_weather_data(latitude: float, longitude: float, days: int = 7):
-    """
-    Fetch weather data from Open-Meteo API
 
-    Args:
-        latitude: Location latitude
-        longitude: Location longitude
-        days: Number of forecast days (1-16)
+# Open-Meteo fields requested for current conditions and the daily forecast
+_CURRENT_KEYS = ("temperature_2m", "apparent_temperature", "relative_humidity_2m",
+                 "wind_speed_10m", "precipitation", "weather_code")
+_DAILY_KEYS = ("weather_code", "temperature_2m_max", "temperature_2m_min", "precipitation_sum")
 
-    Returns:
-        Weather data including current conditions and forecast
-    """
-    # Ensure days is within valid range
-    days = min(max(1, days), 16)
 
-    # Build API URL with parameters
-    base_url = "https://api.open-meteo.com/v1/forecast"
+async def _fetch_weather_data(latitude: float, longitude: float, days: int):
+    """Issue the Open-Meteo forecast request"""
+    # Build API query parameters
     params = {
         "latitude": latitude,
         "longitude": longitude,
-        "current": ["temperature_2m", "relative_humidity_2m", "apparent_temperature", "precipitation", "weather_code", "wind_speed_10m"],
-        "daily": ["weather_code", "temperature_2m_max", "temperature_2m_min", "precipitation_sum"],
+        "current": _CURRENT_KEYS,
+        "daily": _DAILY_KEYS,
         "timezone": "auto",
         "forecast_days": days
     }
 
     try:
-        response = requests.get(base_url, params=params)
+        response = await _client.get("/v1/forecast", params=params)
         response.raise_for_status()  # Raise exception for HTTP errors
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching weather data: {e}")
+        return json_loads(response.content)
+    except (httpx.HTTPError, ValueError) as e:  # ValueError covers malformed JSON
+        logger.error("Error fetching weather data: %s", e)
         return None
 
 
+def _forecast_key(latitude: float, longitude: float, days: int):
+    """Cache key for a forecast: coordinates rounded to 2 decimals and clamped days"""
+    # Ensure days is within valid range
+    days = min(max(1, days), 16)
+    return (round(latitude, 2), round(longitude, 2), days)
+
+
+async def _load_forecast(key):
+    """Fetch a forecast and cache it with no processed responses yet"""
+    data = await _fetch_weather_data(*key)
+    if data is None:  # Failed fetches are not cached
+        return None
+    entry = _FORECAST_CACHE[key] = (data, {})
+    return entry
+
+
+async def _get_forecast_entry(key):
+    """Return the cached (raw data, processed responses) entry for a forecast key"""
+    entry = _FORECAST_CACHE.get(key)
+    if entry is not None:
+        return entry
+
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_load_forecast(key))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+
+    # Shield the shared fetch so one cancelled caller does not cancel the others
+    return await asyncio.shield(task)
+
+
+async def get_weather_data(latitude: float, longitude: float, days: int = 7):
+    """
+    Fetch weather data from Open-Meteo API
+
+    Coordinates are rounded to 2 decimals (~1 km). Results are cached for
+    five minutes, and concurrent requests for the same rounded location
+    share a single in-flight fetch.
+
+    Args:
+        latitude: Location latitude
+        longitude: Location longitude
+        days: Number of forecast days (1-16)
+
+    Returns:
+        Weather data including current conditions and forecast
+    """
+    entry = await _get_forecast_entry(_forecast_key(latitude, longitude, days))
+    return entry[0] if entry else None
+
+
+# WMO weather interpretation codes
+_WEATHER_CODE_DESCRIPTIONS = {
+    0: "Clear sky",
+    1: "Mainly clear", 2: "Partly cloudy", 3: "Overcast",
+    45: "Fog", 48: "Depositing rime fog",
+    51: "Light drizzle", 53: "Moderate drizzle", 55: "Dense drizzle",
+    56: "Light freezing drizzle", 57: "Dense freezing drizzle",
+    61: "Slight rain", 63: "Moderate rain", 65: "Heavy rain",
+    66: "Light freezing rain", 67: "Heavy freezing rain",
+    71: "Slight snow fall", 73: "Moderate snow fall", 75: "Heavy snow fall",
+    77: "Snow grains",
+    80: "Slight rain showers", 81: "Moderate rain showers", 82: "Violent rain showers",
+    85: "Slight snow showers", 86: "Heavy snow showers",
+    95: "Thunderstorm", 96: "Thunderstorm with slight hail", 99: "Thunderstorm with heavy hail"
+}
+
+# Descriptions indexed directly by code (0-99) for constant-time lookup
+_WEATHER_CODES = tuple(_WEATHER_CODE_DESCRIPTIONS.get(code, "Unknown") for code in range(100))
+
+
 def interpret_weather_code(code):
     """Convert weather code to human-readable description"""
-    weather_codes = {
-        0: "Clear sky",
-        1: "Mainly clear", 2: "Partly cloudy", 3: "Overcast",
-        45: "Fog", 48: "Depositing rime fog",
-        51: "Light drizzle", 53: "Moderate drizzle", 55: "Dense drizzle",
-        56: "Light freezing drizzle", 57: "Dense freezing drizzle",
-        61: "Slight rain", 63: "Moderate rain", 65: "Heavy rain",
-        66: "Light freezing rain", 67: "Heavy freezing rain",
-        71: "Slight snow fall", 73: "Moderate snow fall", 75: "Heavy snow fall",
-        77: "Snow grains",
-        80: "Slight rain showers", 81: "Moderate rain showers", 82: "Violent rain showers",
-        85: "Slight snow showers", 86: "Heavy snow showers",
-        95: "Thunderstorm", 96: "Thunderstorm with slight hail", 99: "Thunderstorm with heavy hail"
-    }
-    return weather_codes.get(code, "Unknown")
+    return _WEATHER_CODES[code] if code is not None and 0 <= code < 100 else "Unknown"
 
 
 def process_weather_data(data, location_name):
-    """Process raw weather data into structured format"""
+    """Process raw weather data into internal structured format"""
     if not data:
         return None
 
-    # Process current weather
-    current = data.get("current", {})
-    current_units = data.get("current_units", {})
-
-    if not current:
+    # Open-Meteo always returns every requested field, so index directly and
+    # treat any missing field as a malformed response
+    try:
+        current = data["current"]
+        temperature, feels_like, humidity, wind_speed, precipitation, weather_code = (
+            current[key] for key in _CURRENT_KEYS)
+        daily = data["daily"]
+        times, codes, maxs, mins, precs = (daily[key] for key in ("time",) + _DAILY_KEYS)
+    except KeyError:
         return None
+    current_units = data.get("current_units", {})
 
     # Create current weather object
-    current_weather = CurrentWeather(
-        temperature=current.get("temperature_2m"),
-        feels_like=current.get("apparent_temperature"),
-        humidity=current.get("relative_humidity_2m"),
-        wind_speed=current.get("wind_speed_10m"),
-        precipitation=current.get("precipitation"),
-        conditions=interpret_weather_code(current.get("weather_code", 0)),
+    current_weather = _CurrentWeather(
+        temperature=temperature,
+        feels_like=feels_like,
+        humidity=humidity,
+        wind_speed=wind_speed,
+        precipitation=precipitation,
+        conditions=interpret_weather_code(weather_code),
         units={
             "temperature": current_units.get("temperature_2m", "°C"),
             "feels_like": current_units.get("apparent_temperature", "°C"),
@@ -180,40 +371,74 @@ def process_weather_data(data, location_name):
         }
     )
 
-    # Process forecast
-    daily = data.get("daily", {})
-    forecast_list = []
-
-    if daily and "time" in daily:
-        for i, date in enumerate(daily["time"]):
-            if i < len(daily.get("weather_code", [])):
-                forecast_list.append(
-                    DailyForecast(
-                        date=date,
-                        min_temp=daily.get("temperature_2m_min", [])[i] if i < len(
-                            daily.get("temperature_2m_min", [])) else 0,
-                        max_temp=daily.get("temperature_2m_max", [])[i] if i < len(
-                            daily.get("temperature_2m_max", [])) else 0,
-                        precipitation=daily.get("precipitation_sum", [])[i] if i < len(
-                            daily.get("precipitation_sum", [])) else 0,
-                        conditions=interpret_weather_code(
-                            daily.get("weather_code", [])[i])
-                    )
-                )
+    # Process forecast; zip stops at the shortest column
+    daily_forecast = _DailyForecast  # Local bindings avoid global lookups per day
+    interpret = interpret_weather_code
+    forecast_list = [
+        daily_forecast(
+            date=date,
+            min_temp=min_temp,
+            max_temp=max_temp,
+            precipitation=precipitation,
+            conditions=interpret(code)
+        )
+        for date, code, min_temp, max_temp, precipitation in zip(times, codes, mins, maxs, precs)
+    ]
 
     # Create complete response
-    return WeatherResponse(
+    return _WeatherResponse(
         location=location_name,
-        coordinates=(data.get("latitude"), data.get("longitude")),
+        latitude=data.get("latitude"),
+        longitude=data.get("longitude"),
         current=current_weather,
         forecast=forecast_list
     )
 
+
+def to_weather_response(weather: _WeatherResponse) -> WeatherResponse:
+    """
+    Convert internal weather data into the model returned by the MCP tools
+
+    The data comes from a trusted upstream API, so models are built with
+    model_construct and skip Pydantic validation.
+    """
+    fields = _fields  # Local bindings avoid global lookups per day
+    construct_day = DailyForecast.model_construct
+    return WeatherResponse.model_construct(
+        location=weather.location,
+        latitude=weather.latitude,
+        longitude=weather.longitude,
+        current=CurrentWeather.model_construct(**fields(weather.current)),
+        forecast=[construct_day(**fields(day)) for day in weather.forecast]
+    )
+
+
+async def get_weather_response(latitude: float, longitude: float, days: int, location_name: str):
+    """
+    Fetch and process weather data for a location
+
+    Processed responses are stored in the raw forecast's cache entry, so a
+    repeat request skips building the response models entirely and expires
+    with the raw data.
+    """
+    entry = await _get_forecast_entry(_forecast_key(latitude, longitude, days))
+    if entry is None:
+        return None
+
+    weather_data, responses = entry
+    response = responses.get(location_name)
+    if response is None:
+        weather = process_weather_data(weather_data, location_name)
+        if weather is None:
+            return None
+        response = responses[location_name] = to_weather_response(weather)
+    return response
+
 # MCP Tool: Get weather by city and state
 
 
 @mcp.tool()
-def get_weather(city: str, state: Optional[str] = None, country: str = "USA", days: int = 7) -> WeatherResponse:
+async def get_weather(city: str, state: Optional[str] = None, country: str = "USA", days: int = 7) -> WeatherResponse:
     """
     Get weather forecast for a city
 
@@ -226,8 +451,8 @@ def get_weather(city: str, state: Optional[str] = None, country: str = "USA", da
     Returns:
         Weather data including current conditions and forecast
     """
-    # Get coordinates for the location
-    location = geocode_location(city, state, country)
+    # Get coordinates for the location (geopy is blocking, so keep it off the event loop)
+    location = await asyncio.to_thread(geocode_location, city, state, country)
 
     if not location:
         # If geocoding fails, return an error instead of defaulting to Los Angeles
@@ -239,7 +464,8 @@ def get_weather(city: str, state: Optional[str] = None, country: str = "USA", da
         # Return a structured error response
         return WeatherResponse(
             location=f"Error: {error_message}",
-            coordinates=(0.0, 0.0),
+            latitude=0.0,
+            longitude=0.0,
             current=CurrentWeather(
                 temperature=0.0,
                 feels_like=0.0,
@@ -252,18 +478,15 @@ def get_weather(city: str, state: Optional[str] = None, country: str = "USA", da
             forecast=[]
         )
 
-    # Get weather data
-    weather_data = get_weather_data(
-        location["latitude"], location["longitude"], days)
-
-    # Process and return structured data
-    return process_weather_data(weather_data, location["location_name"])
+    # Get weather data and return it as structured data
+    return await get_weather_response(
+        location["latitude"], location["longitude"], days, location["location_name"])
 
 # MCP Tool: Get weather by coordinates
 
 
 @mcp.tool()
-def get_weather_by_coordinates(latitude: float, longitude: float, days: int = 7) -> WeatherResponse:
+async def get_weather_by_coordinates(latitude: float, longitude: float, days: int = 7) -> WeatherResponse:
     """
     Get weather forecast for specific coordinates
 
@@ -275,11 +498,13 @@ def get_weather_by_coordinates(latitude: float, longitude: float, days: int = 7)
     Returns:
         Weather data including current conditions and forecast
     """
-    # Get weather data
-    weather_data = get_weather_data(latitude, longitude, days)
+    # Label with the rounded cache coordinates so each forecast entry holds
+    # at most one coordinates response
+    rounded_latitude, rounded_longitude, _ = _forecast_key(latitude, longitude, days)
 
-    # Process and return structured data
-    return process_weather_data(weather_data, f"coordinates ({latitude}, {longitude})")
+    # Get weather data and return it as structured data
+    return await get_weather_response(
+        latitude, longitude, days, f"coordinates ({rounded_latitude}, {rounded_longitude})")
 
 # MCP Tool: Get weather alerts for a US state
 
@@ -303,6 +528,14 @@ def get_alerts(state: str) -> dict:
     }
 
 
+async def serve():
+    """Run the MCP server over stdio, closing the shared HTTP client on shutdown"""
+    # The client is closed once per process rather than from a FastMCP
+    # lifespan, which runs for every session
+    async with _client:
+        await mcp.run_stdio_async()
+
+
 if __name__ == "__main__":
     # Start the MCP server
-    mcp.run()
+    asyncio.run(serve())